@@ -1,13 +1,20 @@
 import streamlit as st
-from PyPDF2 import PdfReader
-from difflib import SequenceMatcher
-import base64
-import re
-import requests
-import jieba
-from io import StringIO
 import time
-import json
+from concurrent.futures import as_completed
+from utils import (
+    QWEN_BATCH_SIZE,
+    QWEN_MAX_CONCURRENCY,
+    analyze_compliance_batch_with_qwen,
+    analyze_standalone_batch_with_qwen,
+    call_qwen_api,
+    extract_text_from_pdf,
+    make_thread_pool,
+    match_clauses,
+    split_into_clauses,
+)
+
+# 文本完全相同的匹配对不调用模型，直接使用的分析结论
+IDENTICAL_CLAUSE_ANALYSIS = "两份文件中该条款文本完全一致，不存在差异或冲突，无需修改。"
 
 # 页面设置
 st.set_page_config(
@@ -25,9 +32,6 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# API配置
-QWEN_API_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
-
 # 会话状态初始化
 if 'analysis_progress' not in st.session_state:
     st.session_state.analysis_progress = 0
@@ -37,138 +41,23 @@ if 'partial_report' not in st.session_state:
     st.session_state.partial_report = []
 if 'cancelled' not in st.session_state:
     st.session_state.cancelled = False
+if 'final_report' not in st.session_state:
+    st.session_state.final_report = None
 
-def call_qwen_api(prompt, api_key, timeout=120):
-    """调用API并增加重试机制"""
-    retries = 3
-    delay = 5  # 重试延迟（秒）
-    
-    for attempt in range(retries):
-        try:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {api_key}"
-            }
-            
-            data = {
-                "model": "qwen-plus",
-                "messages": [{"role": "user", "content": prompt}],
-                "temperature": 0.3,
-                "max_tokens": 2000  # 减少单次返回长度，避免超时
-            }
-            
-            response = requests.post(
-                QWEN_API_URL,
-                headers=headers,
-                json=data,
-                timeout=timeout
-            )
-            
-            if response.status_code == 200:
-                response_json = response.json()
-                if "choices" in response_json and len(response_json["choices"]) > 0:
-                    return response_json["choices"][0]["message"]["content"]
-                else:
-                    st.warning(f"API返回格式异常（尝试 {attempt+1}/{retries}）")
-            else:
-                st.warning(f"API请求失败，状态码: {response.status_code}（尝试 {attempt+1}/{retries}）")
-                
-        except requests.exceptions.Timeout:
-            st.warning(f"API请求超时（尝试 {attempt+1}/{retries}）")
-        except Exception as e:
-            st.warning(f"API调用错误: {str(e)}（尝试 {attempt+1}/{retries}）")
-            
-        time.sleep(delay)
-        delay *= 2  # 指数退避
-    
-    return None
-
-def extract_text_from_pdf(file):
-    """提取PDF文本"""
-    try:
-        pdf_reader = PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            page_text = page.extract_text() or ""
-            page_text = page_text.replace("  ", "").replace("\n", "").replace("\r", "")
-            text += page_text
-        return text
-    except Exception as e:
-        st.error(f"提取文本失败: {str(e)}")
-        return ""
-
-def split_into_clauses(text, max_clauses=50):
-    """分割条款并限制数量，避免处理过多内容"""
-    patterns = [
-        r'(第[一二三四五六七八九十百]+条\s+.*?)(?=第[一二三四五六七八九十百]+条\s+|$)',
-        r'([一二三四五六七八九十]+、\s+.*?)(?=[一二三四五六七八九十]+、\s+|$)',
-        r'(\d+\.\s+.*?)(?=\d+\.\s+|$)',
-        r'(\([一二三四五六七八九十]+\)\s+.*?)(?=\([一二三四五六七八九十]+\)\s+|$)',
-        r'(\([1-9]+\)\s+.*?)(?=\([1-9]+\)\s+|$)',
-        r'(【[^\】]+】\s+.*?)(?=【[^\】]+】\s+|$)'
-    ]
-    
-    for pattern in patterns:
-        clauses = re.findall(pattern, text, re.DOTALL)
-        if len(clauses) > 3:
-            # 限制最大条款数，避免处理量过大
-            return [clause.strip() for clause in clauses if clause.strip()][:max_clauses]
-    
-    paragraphs = re.split(r'[。；！？]\s*', text)
-    paragraphs = [p.strip() for p in paragraphs if p.strip() and len(p) > 10]
-    return paragraphs[:max_clauses]
-
-def chinese_text_similarity(text1, text2):
-    """计算中文文本相似度"""
-    words1 = list(jieba.cut(text1))
-    words2 = list(jieba.cut(text2))
-    return SequenceMatcher(None, words1, words2).ratio()
-
-def match_clauses(clauses1, clauses2):
-    """匹配条款"""
-    matched_pairs = []
-    used_indices = set()
-    
-    for i, clause1 in enumerate(clauses1):
-        best_match = None
-        best_ratio = 0.25
-        best_j = -1
-        
-        for j, clause2 in enumerate(clauses2):
-            if j not in used_indices:
-                ratio = chinese_text_similarity(clause1, clause2)
-                if ratio > best_ratio:
-                    best_ratio = ratio
-                    best_match = clause2
-                    best_j = j
-        
-        if best_match:
-            matched_pairs.append((clause1, best_match, best_ratio))
-            used_indices.add(best_j)
-    
-    unmatched1 = [clause for i, clause in enumerate(clauses1) 
-                 if i not in [idx for idx, _ in enumerate(matched_pairs)]]
-    unmatched2 = [clause for j, clause in enumerate(clauses2) if j not in used_indices]
-    
-    return matched_pairs, unmatched1, unmatched2
-
-def update_progress(total_steps, current_step, status):
+def update_progress(progress_bar, status_text, total_steps, current_step, status):
     """更新进度条和状态文本"""
     progress = current_step / total_steps
     st.session_state.analysis_progress = progress
     st.session_state.analysis_status = status
     
     # 更新UI
-    progress_bar = st.progress(progress)
-    status_text = st.markdown(f"<p class='status-text'>{status}</p>", unsafe_allow_html=True)
-    
-    return progress_bar, status_text
+    progress_bar.progress(progress)
+    status_text.markdown(f"<p class='status-text'>{status}</p>", unsafe_allow_html=True)
 
 def generate_analysis_report(matched_pairs, unmatched1, unmatched2, 
                             filename1, filename2, api_key):
     """生成分析报告，带进度跟踪和部分结果保存"""
     # 重置会话状态
-    st.session_state.partial_report = []
     st.session_state.analysis_progress = 0
     st.session_state.cancelled = False
     
@@ -178,8 +67,9 @@ def generate_analysis_report(matched_pairs, unmatched1, unmatched2,
                   len(unmatched2) + 1)  # +1 是总结部分
     current_step = 0
     
-    # 初始化报告
+    # 初始化报告，部分报告与其共享同一列表，随生成进度自动保存，无需逐步复制
     report = []
+    st.session_state.partial_report = report
     report.append("="*50)
     report.append(f"条款合规性分析报告")
     report.append(f"对比文件: {filename1} 与 {filename2}")
@@ -195,119 +85,154 @@ def generate_analysis_report(matched_pairs, unmatched1, unmatched2,
     report.append(f"- {filename2} 独有条款数: {len(unmatched2)}\n")
     report.append("-"*50 + "\n")
     
-    # 保存部分报告
-    st.session_state.partial_report = report.copy()
-    
-    # 显示进度条
-    progress_bar, status_text = update_progress(
-        total_steps, current_step, "准备分析匹配条款..."
+    # 显示进度条，进度条和状态文本只创建一次
+    progress_bar = st.progress(0.0)
+    status_text = st.empty()
+    update_progress(
+        progress_bar, status_text, total_steps, current_step, "准备分析匹配条款..."
     )
     
-    # 匹配条款分析（分批处理）
-    report.append("一、匹配条款分析")
-    report.append("-"*50)
-    
-    for i, (clause1, clause2, ratio) in enumerate(matched_pairs):
-        # 检查是否取消
-        if st.session_state.cancelled:
-            report.append("\n\n分析已取消，以下是部分结果...")
-            return "\n".join(report)
-            
-        current_step += 1
-        progress_bar, status_text = update_progress(
-            total_steps, current_step, 
-            f"分析匹配条款 {i+1}/{len(matched_pairs)}..."
+    # API调用是I/O密集型，一次性并发提交所有条款的分析请求，再按原顺序写入报告
+    executor = make_thread_pool(QWEN_MAX_CONCURRENCY)
+    # 总结提示词不依赖各条款的分析结果，最先提交，与条款分析并行完成
+    summary_prompt = f"""
+    基于以上对{filename1}和{filename2}的条款对比分析，请给出一份总体总结和建议，包括：
+    1. 两份文件的总体合规性评估
+    2. 主要冲突点汇总
+    3. 整体修改建议
+    4. 风险提示
+    """
+    summary_future = executor.submit(call_qwen_api, summary_prompt, api_key)
+    # 文本完全相同的匹配对结论确定，不发送请求；相似度很高但不完全相同的条款
+    # 可能只改了期限或金额，仍需模型分析
+    pending_pairs = [i for i, (clause1, clause2, _) in enumerate(matched_pairs) if clause1 != clause2]
+    current_step += len(matched_pairs) - len(pending_pairs)
+    # 其余匹配条款按批合并到同一请求中，摊薄每次请求的网络往返和提示词开销
+    matched_futures = [
+        executor.submit(
+            analyze_compliance_batch_with_qwen,
+            [matched_pairs[i][:2] for i in pending_pairs[k:k + QWEN_BATCH_SIZE]],
+            filename1, filename2, api_key
         )
-        
-        report.append(f"\n匹配对 {i+1} (相似度: {ratio:.2%})")
-        report.append(f"{filename1} 条款: {clause1[:200]}...")  # 截断长条款
-        report.append(f"{filename2} 条款: {clause2[:200]}...")
-        
-        # 调用API分析
-        analysis = analyze_compliance_with_qwen(clause1, clause2, filename1, filename2, api_key)
-        if analysis:
-            report.append("分析结果:")
-            report.append(analysis)
-        else:
-            report.append("分析结果: 无法获取有效分析（API调用失败）")
-        
-        report.append("-"*30)
-        
-        # 保存部分报告，防止中途失败丢失所有结果
-        st.session_state.partial_report = report.copy()
-        time.sleep(1)  # 避免API请求过于频繁
-
-    # 未匹配条款1分析
-    report.append("\n二、未匹配条款分析")
-    report.append("-"*50)
-    report.append(f"\n{filename1} 独有条款:")
-    
-    for i, clause in enumerate(unmatched1):
-        if st.session_state.cancelled:
-            report.append("\n\n分析已取消，以下是部分结果...")
-            return "\n".join(report)
-            
-        current_step += 1
-        progress_bar, status_text = update_progress(
-            total_steps, current_step, 
-            f"分析{filename1}独有条款 {i+1}/{len(unmatched1)}..."
+        for k in range(0, len(pending_pairs), QWEN_BATCH_SIZE)
+    ]
+    # 各待分析匹配对所在的批次及其在批次结果中的位置
+    pair_slots = {
+        i: (matched_futures[k // QWEN_BATCH_SIZE], k % QWEN_BATCH_SIZE)
+        for k, i in enumerate(pending_pairs)
+    }
+    # 独有条款同样按批合并请求
+    unmatched1_futures = [
+        executor.submit(
+            analyze_standalone_batch_with_qwen,
+            unmatched1[k:k + QWEN_BATCH_SIZE], filename1, api_key
+        )
+        for k in range(0, len(unmatched1), QWEN_BATCH_SIZE)
+    ]
+    unmatched2_futures = [
+        executor.submit(
+            analyze_standalone_batch_with_qwen,
+            unmatched2[k:k + QWEN_BATCH_SIZE], filename2, api_key
         )
+        for k in range(0, len(unmatched2), QWEN_BATCH_SIZE)
+    ]
+    
+    # 各批次包含的条款数，用于按完成情况推进进度
+    batch_sizes = {}
+    for futures, items in ((matched_futures, pending_pairs),
+                           (unmatched1_futures, unmatched1),
+                           (unmatched2_futures, unmatched2)):
+        for k, future in enumerate(futures):
+            batch_sizes[future] = min(QWEN_BATCH_SIZE, len(items) - k * QWEN_BATCH_SIZE)
+    
+    try:
+        # 按完成先后推进进度，先返回的批次立即计入，不被排在前面的慢请求阻塞
+        for future in as_completed(batch_sizes):
+            if st.session_state.cancelled:
+                break
+            current_step += batch_sizes[future]
+            update_progress(
+                progress_bar, status_text, total_steps, current_step, 
+                f"已完成条款分析 {current_step}/{total_steps - 1}..."
+            )
         
-        report.append(f"\n条款 {i+1}: {clause[:200]}...")
-        analysis = analyze_standalone_clause_with_qwen(clause, filename1, api_key)
-        if analysis:
-            report.append("分析结果:")
-            report.append(analysis)
-        else:
-            report.append("分析结果: 无法获取有效分析（API调用失败）")
+        # 匹配条款分析（分批处理），结果按原顺序写入报告
+        report.append("一、匹配条款分析")
+        report.append("-"*50)
         
-        report.append("-"*30)
-        st.session_state.partial_report = report.copy()
-        time.sleep(1)
-
-    # 未匹配条款2分析
-    report.append(f"\n{filename2} 独有条款:")
-    
-    for i, clause in enumerate(unmatched2):
-        if st.session_state.cancelled:
-            report.append("\n\n分析已取消，以下是部分结果...")
-            return "\n".join(report)
+        for i, (clause1, clause2, ratio) in enumerate(matched_pairs):
+            future, slot = pair_slots.get(i, (None, None))
+            # 检查是否取消，取消后只写入已完成的结果
+            if st.session_state.cancelled and future is not None and not future.done():
+                report.append("\n\n分析已取消，以下是部分结果...")
+                return "\n".join(report)
             
-        current_step += 1
-        progress_bar, status_text = update_progress(
-            total_steps, current_step, 
-            f"分析{filename2}独有条款 {i+1}/{len(unmatched2)}..."
-        )
+            report.append(f"\n匹配对 {i+1} (相似度: {ratio:.2%})")
+            report.append(f"{filename1} 条款: {clause1[:200]}...")  # 截断长条款
+            report.append(f"{filename2} 条款: {clause2[:200]}...")
+            
+            analysis = future.result()[slot] if future is not None else IDENTICAL_CLAUSE_ANALYSIS
+            if analysis:
+                report.append("分析结果:")
+                report.append(analysis)
+            else:
+                report.append("分析结果: 无法获取有效分析（API调用失败）")
+            
+            report.append("-"*30)
+
+        # 未匹配条款1分析
+        report.append("\n二、未匹配条款分析")
+        report.append("-"*50)
+        report.append(f"\n{filename1} 独有条款:")
         
-        report.append(f"\n条款 {i+1}: {clause[:200]}...")
-        analysis = analyze_standalone_clause_with_qwen(clause, filename2, api_key)
-        if analysis:
-            report.append("分析结果:")
-            report.append(analysis)
-        else:
-            report.append("分析结果: 无法获取有效分析（API调用失败）")
+        for i, clause in enumerate(unmatched1):
+            future = unmatched1_futures[i // QWEN_BATCH_SIZE]
+            if st.session_state.cancelled and not future.done():
+                report.append("\n\n分析已取消，以下是部分结果...")
+                return "\n".join(report)
+            
+            report.append(f"\n条款 {i+1}: {clause[:200]}...")
+            analysis = future.result()[i % QWEN_BATCH_SIZE]
+            if analysis:
+                report.append("分析结果:")
+                report.append(analysis)
+            else:
+                report.append("分析结果: 无法获取有效分析（API调用失败）")
+            
+            report.append("-"*30)
+
+        # 未匹配条款2分析
+        report.append(f"\n{filename2} 独有条款:")
         
-        report.append("-"*30)
-        st.session_state.partial_report = report.copy()
-        time.sleep(1)
+        for i, clause in enumerate(unmatched2):
+            future = unmatched2_futures[i // QWEN_BATCH_SIZE]
+            if st.session_state.cancelled and not future.done():
+                report.append("\n\n分析已取消，以下是部分结果...")
+                return "\n".join(report)
+            
+            report.append(f"\n条款 {i+1}: {clause[:200]}...")
+            analysis = future.result()[i % QWEN_BATCH_SIZE]
+            if analysis:
+                report.append("分析结果:")
+                report.append(analysis)
+            else:
+                report.append("分析结果: 无法获取有效分析（API调用失败）")
+            
+            report.append("-"*30)
+    finally:
+        # 取消或出错时丢弃尚未开始的请求，不等待其完成
+        executor.shutdown(wait=False, cancel_futures=True)
 
     # 总结建议
     current_step += 1
-    progress_bar, status_text = update_progress(
-        total_steps, current_step, "生成总体总结与建议..."
+    update_progress(
+        progress_bar, status_text, total_steps, current_step, "生成总体总结与建议..."
     )
     
     report.append("\n三、总结与建议")
     report.append("-"*50)
     
-    summary_prompt = f"""
-    基于以上对{filename1}和{filename2}的条款对比分析，请给出一份总体总结和建议，包括：
-    1. 两份文件的总体合规性评估
-    2. 主要冲突点汇总
-    3. 整体修改建议
-    4. 风险提示
-    """
-    summary = call_qwen_api(summary_prompt, api_key)
+    summary = summary_future.result()
     if summary:
         report.append(summary)
     else:
@@ -315,45 +240,9 @@ def generate_analysis_report(matched_pairs, unmatched1, unmatched2,
     
     return "\n".join(report)
 
-def analyze_compliance_with_qwen(clause1, clause2, filename1, filename2, api_key):
-    """分析条款合规性"""
-    # 缩短提示词和条款长度，避免API超时
-    prompt = f"""
-    分析以下两个条款的合规性：
-    
-    {filename1} 条款：{clause1[:500]}
-    {filename2} 条款：{clause2[:500]}
-    
-    请简要分析：
-    1. 相似度（高/中/低）
-    2. 主要差异
-    3. 是否存在冲突
-    4. 简要建议
-    """
-    
-    return call_qwen_api(prompt, api_key)
-
-def analyze_standalone_clause_with_qwen(clause, doc_name, api_key):
-    """分析独立条款"""
-    prompt = f"""
-    分析以下条款：{doc_name} 中的条款：{clause[:500]}
-    
-    请简要评估：
-    1. 主要内容
-    2. 核心要求
-    3. 潜在问题
-    4. 简要建议
-    """
-    
-    return call_qwen_api(prompt, api_key)
-
-def get_download_link(text, filename):
-    """生成下载链接"""
-    buffer = StringIO()
-    buffer.write(text)
-    buffer.seek(0)
-    b64 = base64.b64encode(buffer.read().encode()).decode()
-    return f'<a href="data:text/plain;base64,{b64}" download="{filename}" class="btn btn-primary">下载分析报告</a>'
+def show_download_button(text, filename, label="下载分析报告"):
+    """显示下载按钮"""
+    st.download_button(label, data=text.encode("utf-8"), file_name=filename, mime="text/plain")
 
 def main():
     st.title("PDF条款合规性分析工具")
@@ -382,6 +271,7 @@ def main():
             st.session_state.cancelled = True
     
     if start_analysis:
+        st.session_state.final_report = None
         try:
             with st.spinner("准备分析..."):
                 # 提取文本
@@ -402,17 +292,10 @@ def main():
                 matched_pairs, unmatched1, unmatched2 = match_clauses(clauses1, clauses2)
             
             # 生成报告
-            report = generate_analysis_report(
+            st.session_state.final_report = generate_analysis_report(
                 matched_pairs, unmatched1, unmatched2,
                 file1.name, file2.name, api_key
             )
-            
-            # 显示结果
-            st.success("分析完成！")
-            st.markdown(get_download_link(report, "条款合规性分析报告.txt"), unsafe_allow_html=True)
-            
-            with st.expander("查看报告预览"):
-                st.text_area("报告内容", report, height=300)
                 
         except Exception as e:
             st.error(f"分析过程出错: {str(e)}")
@@ -421,9 +304,18 @@ def main():
             if st.session_state.partial_report:
                 st.warning("以下是已完成的部分分析结果：")
                 partial_report_text = "\n".join(st.session_state.partial_report)
-                st.markdown(get_download_link(partial_report_text, "部分条款分析报告.txt"), unsafe_allow_html=True)
+                show_download_button(partial_report_text, "部分条款分析报告.txt", "下载部分分析报告")
                 with st.expander("查看部分报告"):
                     st.text_area("部分报告内容", partial_report_text, height=300)
+    
+    # 显示结果：报告保存在会话状态中，点击下载按钮触发页面重跑后仍然保留
+    report = st.session_state.final_report
+    if report:
+        st.success("分析完成！")
+        show_download_button(report, "条款合规性分析报告.txt")
+        
+        with st.expander("查看报告预览"):
+            st.text_area("报告内容", report, height=300)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,416 @@
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+try:
+    # PyMuPDF基于C实现，提取速度远快于纯Python的PyPDF2
+    import pymupdf
+except ImportError:
+    pymupdf = None
+from PyPDF2 import PdfReader
+try:
+    # C实现的difflib，接口与输出和标准库一致
+    from cydifflib import SequenceMatcher
+except ImportError:
+    from difflib import SequenceMatcher
+from rapidfuzz import process as rapidfuzz_process
+from rapidfuzz.distance import Indel
+import re
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import jieba
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from io import BytesIO
+import time
+import json
+import threading
+import atexit
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+# API配置
+QWEN_API_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1/chat/completions"
+QWEN_MODEL = "qwen-plus"
+QWEN_MAX_CONCURRENCY = 8  # 并发请求数上限，避免超出API限流
+QWEN_BATCH_SIZE = 5  # 每次请求合并分析的匹配条款对数
+QWEN_MAX_QPS = 10  # 每秒最多发出的请求数
+CLAUSE_PROMPT_LIMIT = 500  # 提示词中单个条款保留的最大字数
+
+# 复用连接的HTTP会话：各请求共享TLS连接，限流和网关错误在连接层快速重试
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=QWEN_MAX_CONCURRENCY,
+    pool_maxsize=QWEN_MAX_CONCURRENCY,
+    max_retries=Retry(
+        total=2,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["POST"],
+        raise_on_status=False
+    )
+))
+# 进程退出时关闭连接池中的长连接
+atexit.register(HTTP_SESSION.close)
+
+# 最近QWEN_MAX_QPS次请求的发出时间，用于滑动窗口限流
+REQUEST_TIMES = deque(maxlen=QWEN_MAX_QPS)
+REQUEST_TIMES_LOCK = threading.Lock()
+
+# 条款编号模式（按优先级排列），只匹配条款开头的编号，模块加载时预编译
+CLAUSE_HEADER_PATTERNS = [
+    re.compile(pattern) for pattern in (
+        r'第[一二三四五六七八九十百]+条\s+',
+        r'[一二三四五六七八九十]+、\s+',
+        r'\d+\.\s+',
+        r'\([一二三四五六七八九十]+\)\s+',
+        r'\([1-9]+\)\s+',
+        r'【[^\】]+】\s+'
+    )
+]
+
+# 无编号时按句末标点切分段落
+SENTENCE_SPLIT_PATTERN = re.compile(r'[。；！？]\s*')
+
+# 模型回复中的JSON代码块
+JSON_BLOCK_PATTERN = re.compile(r'```(?:json)?\s*(.*?)```', re.DOTALL)
+
+# 在后台线程预加载jieba词典：导入时不阻塞页面首次渲染，首次分词时若仍在加载会等待其完成
+threading.Thread(target=jieba.initialize, daemon=True).start()
+
+class ReplyTruncatedError(Exception):
+    """模型回复达到max_tokens上限被截断"""
+    def __init__(self, text):
+        super().__init__("API回复达到长度上限被截断")
+        self.text = text
+
+def wait_for_rate_limit():
+    """按每秒请求数限流"""
+    with REQUEST_TIMES_LOCK:
+        now = time.monotonic()
+        if len(REQUEST_TIMES) == REQUEST_TIMES.maxlen:
+            wait = REQUEST_TIMES[0] + 1.0 - now
+            if wait > 0:
+                time.sleep(wait)
+                now = time.monotonic()
+        REQUEST_TIMES.append(now)
+
+@st.cache_data(ttl=86400, show_spinner=False)
+def request_qwen_completion(prompt, model, temperature, max_tokens, json_mode, _api_key, _timeout):
+    """发送单次API请求，失败时抛出异常"""
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {_api_key}"
+    }
+    
+    data = {
+        "model": model,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": True
+    }
+    if json_mode:
+        # 约束模型只输出合法的JSON对象
+        data["response_format"] = {"type": "json_object"}
+    
+    # 只有未命中缓存、真正发出的请求才计入限流
+    wait_for_rate_limit()
+    
+    # 流式接收：超时只约束相邻数据块的间隔，长回复不会因整体耗时超时而整段重试
+    with HTTP_SESSION.post(
+        QWEN_API_URL,
+        headers=headers,
+        json=data,
+        timeout=_timeout,
+        stream=True
+    ) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"API请求失败，状态码: {response.status_code}")
+        return read_stream_content(response)
+
+def read_stream_content(response):
+    """解析流式响应，拼接回复内容"""
+    parts = []
+    received = False
+    done = False
+    finish_reason = None
+    for line in response.iter_lines():
+        # 按字节切行后再以UTF-8解码，避免响应未声明编码时中文乱码
+        line = line.decode("utf-8").strip()
+        if not line.startswith("data:"):
+            continue
+        payload = line[5:].strip()
+        if payload == "[DONE]":
+            done = True
+            break
+        chunk = json.loads(payload)
+        if chunk.get("choices"):
+            received = True
+            choice = chunk["choices"][0]
+            parts.append(choice.get("delta", {}).get("content") or "")
+            finish_reason = choice.get("finish_reason") or finish_reason
+    
+    if not received:
+        raise RuntimeError("API返回格式异常")
+    # 不完整的回复抛出异常，不会被缓存；流中断可重试，长度截断重试也会再次截断
+    if not done:
+        raise RuntimeError("API响应流意外中断")
+    if finish_reason == "length":
+        raise ReplyTruncatedError("".join(parts))
+    if finish_reason != "stop":
+        raise RuntimeError(f"API回复未正常结束（finish_reason: {finish_reason}）")
+    return "".join(parts)
+
+def call_qwen_api(prompt, api_key, max_tokens=2000, json_mode=False, timeout=120, allow_truncated=True):
+    """调用API并增加重试机制"""
+    retries = 3
+    delay = 5  # 重试延迟（秒）
+    
+    for attempt in range(retries):
+        try:
+            return request_qwen_completion(prompt, QWEN_MODEL, 0.3, max_tokens, json_mode, api_key, timeout)
+        except ReplyTruncatedError as e:
+            # 截断不重试：默认返回已生成的部分，否则交由调用方处理
+            if allow_truncated:
+                return e.text
+            raise
+        except requests.exceptions.Timeout:
+            st.warning(f"API请求超时（尝试 {attempt+1}/{retries}）")
+        except RuntimeError as e:
+            st.warning(f"{str(e)}（尝试 {attempt+1}/{retries}）")
+        except Exception as e:
+            st.warning(f"API调用错误: {str(e)}（尝试 {attempt+1}/{retries}）")
+            
+        time.sleep(delay)
+        delay *= 2  # 指数退避
+    
+    return None
+
+def make_thread_pool(max_workers):
+    """创建继承会话上下文的线程池"""
+    ctx = get_script_run_ctx()
+    return ThreadPoolExecutor(
+        max_workers=max_workers,
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)
+    )
+
+def clean_extracted_text(text):
+    """去除提取文本中的连续空格和换行"""
+    return text.replace("  ", "").replace("\n", "").replace("\r", "")
+
+@st.cache_data(show_spinner=False)
+def _extract_text(data):
+    """从PDF字节中提取文本"""
+    if pymupdf is not None:
+        try:
+            with pymupdf.open(stream=data, filetype="pdf") as doc:
+                return clean_extracted_text("".join(page.get_text("text") for page in doc))
+        except Exception:
+            pass
+    
+    pdf_reader = PdfReader(BytesIO(data))
+    return clean_extracted_text("".join(page.extract_text() or "" for page in pdf_reader.pages))
+
+def extract_text_from_pdf(file):
+    """提取PDF文本"""
+    try:
+        return _extract_text(file.getvalue())
+    except Exception as e:
+        st.error(f"提取文本失败: {str(e)}")
+        return ""
+
+@st.cache_data(show_spinner=False)
+def split_into_clauses(text, max_clauses=50):
+    """分割条款并限制数量，避免处理过多内容"""
+    for pattern in CLAUSE_HEADER_PATTERNS:
+        # 一次线性扫描定位各条款编号，相邻编号之间即为一条条款，无需逐字符做前瞻匹配
+        starts = [match.start() for match in pattern.finditer(text)]
+        if len(starts) > 3:
+            clauses = [text[start:end] for start, end in zip(starts, starts[1:] + [len(text)])]
+            # 限制最大条款数，避免处理量过大
+            return [clause.strip() for clause in clauses if clause.strip()][:max_clauses]
+    
+    paragraphs = SENTENCE_SPLIT_PATTERN.split(text)
+    paragraphs = [p.strip() for p in paragraphs if p.strip() and len(p) > 10]
+    return paragraphs[:max_clauses]
+
+@lru_cache(maxsize=4096)
+def tokenize(text):
+    """jieba分词"""
+    return tuple(jieba.cut(text))
+
+@st.cache_data(show_spinner=False)
+def match_clauses(clauses1, clauses2, threshold=0.25):
+    """匹配条款"""
+    matched_pairs = []
+    used_indices1 = set()
+    used_indices2 = set()
+    
+    # 重复条款（如模板套话）只分词和计算一次相似度，最后按原下标展开
+    unique1 = list(dict.fromkeys(clauses1))
+    unique2 = list(dict.fromkeys(clauses2))
+    words1 = [tokenize(clause) for clause in unique1]
+    words2 = [tokenize(clause) for clause in unique2]
+    
+    # 先批量计算所有条款对的相似度上界，只有上界超过阈值的候选对才需要精确匹配
+    # Indel相似度为2*LCS/(len(a)+len(b))，匹配块必为公共子序列，故不低于ratio
+    upper_bounds = rapidfuzz_process.cdist(
+        words1, words2, scorer=Indel.normalized_similarity, dtype=np.float64, workers=-1
+    )
+    
+    similarity = np.zeros((len(unique1), len(unique2)))
+    matcher = SequenceMatcher(autojunk=False)
+    for j in range(len(unique2)):
+        candidates = np.flatnonzero(upper_bounds[:, j] > threshold)
+        if candidates.size == 0:
+            continue
+        # 每个clause2只建立一次匹配索引，供所有候选clause1复用
+        matcher.set_seq2(words2[j])
+        for i in candidates:
+            matcher.set_seq1(words1[i])
+            ratio = matcher.ratio()
+            if ratio > threshold:
+                similarity[i, j] = ratio
+    
+    position1 = {clause: k for k, clause in enumerate(unique1)}
+    position2 = {clause: k for k, clause in enumerate(unique2)}
+    similarity = similarity[np.ix_(
+        [position1[clause] for clause in clauses1],
+        [position2[clause] for clause in clauses2]
+    )]
+    
+    # 匈牙利算法求总相似度最大的匹配，避免贪心匹配抢占后续更优的配对
+    rows, cols = linear_sum_assignment(similarity, maximize=True)
+    for i, j in zip(rows, cols):
+        if similarity[i, j] > 0:
+            matched_pairs.append((clauses1[i], clauses2[j], float(similarity[i, j])))
+            used_indices1.add(i)
+            used_indices2.add(j)
+    
+    unmatched1 = [clause for i, clause in enumerate(clauses1) if i not in used_indices1]
+    unmatched2 = [clause for j, clause in enumerate(clauses2) if j not in used_indices2]
+    
+    return matched_pairs, unmatched1, unmatched2
+
+def truncate_text(text, limit=CLAUSE_PROMPT_LIMIT):
+    """截断过长条款，保留开头和结尾"""
+    if len(text) <= limit:
+        return text
+    tail = limit // 5
+    return f"{text[:limit - tail]}...[省略]...{text[-tail:]}"
+
+def analyze_compliance_with_qwen(clause1, clause2, filename1, filename2, api_key):
+    """分析条款合规性"""
+    # 缩短提示词和条款长度，避免API超时
+    prompt = f"""
+    分析以下两个条款的合规性：
+    
+    {filename1} 条款：{truncate_text(clause1)}
+    {filename2} 条款：{truncate_text(clause2)}
+    
+    请简要分析：
+    1. 相似度（高/中/低）
+    2. 主要差异
+    3. 是否存在冲突
+    4. 简要建议
+    """
+    
+    return call_qwen_api(prompt, api_key)
+
+def parse_json_reply(reply):
+    """解析模型返回的JSON"""
+    match = JSON_BLOCK_PATTERN.search(reply)
+    return json.loads(match.group(1) if match else reply)
+
+def format_batch_analysis(entry):
+    """整理单条批量分析结果"""
+    return "\n".join(f"{key}: {value}" for key, value in entry.items() if key != "id")
+
+def request_batch_analysis(prompt, count, api_key, max_tokens):
+    """发送批量分析请求并按id整理结果"""
+    results = [None] * count
+    try:
+        reply = call_qwen_api(prompt, api_key, max_tokens=max_tokens, json_mode=True, allow_truncated=False)
+    except ReplyTruncatedError:
+        # 批量回复超出长度上限，各项均视为缺失，由调用方逐项请求
+        return results
+    if reply is None:
+        return None
+    
+    try:
+        entries = parse_json_reply(reply)
+    except ValueError:
+        entries = []
+    if isinstance(entries, dict):
+        entries = entries.get("results")
+    for entry in entries if isinstance(entries, list) else []:
+        index = entry.get("id") if isinstance(entry, dict) else None
+        if isinstance(index, int) and 1 <= index <= count:
+            results[index - 1] = format_batch_analysis(entry)
+    return results
+
+def analyze_compliance_batch_with_qwen(pairs, filename1, filename2, api_key):
+    """批量分析条款合规性"""
+    items = [
+        {"id": k + 1, "A": truncate_text(clause1), "B": truncate_text(clause2)}
+        for k, (clause1, clause2) in enumerate(pairs)
+    ]
+    prompt = f"""
+    分析以下{len(pairs)}组条款的合规性，A为{filename1}条款，B为{filename2}条款：
+    
+    {json.dumps(items, ensure_ascii=False)}
+    
+    请对每组简要分析，只返回JSON对象，不要输出其他内容，格式如下：
+    {{"results": [{{"id": 1, "相似度": "高/中/低", "主要差异": "...", "是否存在冲突": "...", "简要建议": "..."}}]}}
+    """
+    
+    # 回复长度按每组800 tokens合计，超出时由逐对分析补全
+    results = request_batch_analysis(prompt, len(pairs), api_key, 800 * len(pairs))
+    if results is None:
+        # 批量请求已重试仍失败，逐对请求同样会失败，不再重试
+        return [None] * len(pairs)
+    
+    # 批量结果缺失或无法解析的条款对，退回逐对分析
+    for k, (clause1, clause2) in enumerate(pairs):
+        if results[k] is None:
+            results[k] = analyze_compliance_with_qwen(clause1, clause2, filename1, filename2, api_key)
+    return results
+
+def analyze_standalone_clause_with_qwen(clause, doc_name, api_key):
+    """分析独立条款"""
+    prompt = f"""
+    分析以下条款：{doc_name} 中的条款：{truncate_text(clause)}
+    
+    请简要评估：
+    1. 主要内容
+    2. 核心要求
+    3. 潜在问题
+    4. 简要建议
+    """
+    
+    return call_qwen_api(prompt, api_key)
+
+def analyze_standalone_batch_with_qwen(clauses, doc_name, api_key):
+    """批量分析独立条款"""
+    items = [{"id": k + 1, "条款": truncate_text(clause)} for k, clause in enumerate(clauses)]
+    prompt = f"""
+    分析以下{len(clauses)}条{doc_name}中的条款：
+    
+    {json.dumps(items, ensure_ascii=False)}
+    
+    请对每条简要评估，只返回JSON对象，不要输出其他内容，格式如下：
+    {{"results": [{{"id": 1, "主要内容": "...", "核心要求": "...", "潜在问题": "...", "简要建议": "..."}}]}}
+    """
+    
+    # 回复长度按每条500 tokens合计，超出时由逐条分析补全
+    results = request_batch_analysis(prompt, len(clauses), api_key, 500 * len(clauses))
+    if results is None:
+        # 批量请求已重试仍失败，逐条请求同样会失败，不再重试
+        return [None] * len(clauses)
+    
+    # 批量结果缺失或无法解析的条款，退回逐条分析
+    for k, clause in enumerate(clauses):
+        if results[k] is None:
+            results[k] = analyze_standalone_clause_with_qwen(clause, doc_name, api_key)
+    return results